@@ -0,0 +1,348 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+DB_FILE = os.environ.get("DB_FILE") or os.path.join(DATA_DIR, "quiz.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tests (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    price_inr REAL NOT NULL DEFAULT 0,
+    filename TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    name TEXT,
+    mobile TEXT,
+    institute TEXT,
+    address TEXT,
+    paid INTEGER NOT NULL DEFAULT 0,
+    payment_id TEXT,
+    order_id TEXT,
+    payable REAL,
+    price REAL,
+    score INTEGER,
+    answers TEXT,
+    ref TEXT,
+    coupon_used TEXT,
+    created_at TEXT,
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_test_id ON submissions(test_id);
+CREATE TABLE IF NOT EXISTS coupons (
+    code TEXT PRIMARY KEY,
+    owner_submission_id TEXT,
+    referred_submission_id TEXT,
+    discount_percent REAL NOT NULL DEFAULT 0,
+    used INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_coupons_owner_referred ON coupons(owner_submission_id, referred_submission_id);
+"""
+
+TEST_COLUMNS = ("id", "title", "price_inr", "filename", "created_at")
+SUBMISSION_COLUMNS = (
+    "id", "test_id", "name", "mobile", "institute", "address", "paid",
+    "payment_id", "order_id", "payable", "price", "score", "answers", "ref",
+    "coupon_used", "created_at", "completed_at"
+)
+COUPON_COLUMNS = (
+    "code", "owner_submission_id", "referred_submission_id",
+    "discount_percent", "used", "created_at"
+)
+
+
+def _dumps(data):
+    if orjson:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _loads(raw):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+_conn = None
+_conn_pid = None
+_lock = threading.RLock()
+
+
+def get_conn():
+    global _conn, _conn_pid
+    # A connection must not cross a fork; wsgi.py closes the master's before
+    # workers are forked, and the pid check makes each process open its own
+    if _conn is None or _conn_pid != os.getpid():
+        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _conn = conn
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def close():
+    # Close this process's connection; the next call to get_conn reopens it
+    global _conn, _conn_pid
+    with _lock:
+        if _conn is not None and _conn_pid == os.getpid():
+            _conn.close()
+        _conn = None
+        _conn_pid = None
+
+
+def _execute(sql, params=()):
+    with _lock:
+        conn = get_conn()
+        with conn:
+            return conn.execute(sql, params)
+
+
+def _fetchone(sql, params=()):
+    with _lock:
+        return get_conn().execute(sql, params).fetchone()
+
+
+def _fetchall(sql, params=()):
+    with _lock:
+        return get_conn().execute(sql, params).fetchall()
+
+
+def init_db():
+    with _lock:
+        get_conn().executescript(SCHEMA)
+
+
+def compact():
+    # Fold the write-ahead log back into the main file and truncate it
+    with _lock:
+        get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# Row <-> dict helpers
+
+def _submission_from_row(row):
+    if row is None:
+        return None
+    sub = dict(row)
+    sub["paid"] = bool(sub["paid"])
+    sub["answers"] = _loads(sub["answers"]) if sub["answers"] else {}
+    return sub
+
+
+def _coupon_from_row(row):
+    if row is None:
+        return None
+    coupon = dict(row)
+    coupon["used"] = bool(coupon["used"])
+    return coupon
+
+
+def _submission_values(fields):
+    values = dict(fields)
+    if "paid" in values:
+        values["paid"] = int(bool(values["paid"]))
+    if "answers" in values:
+        values["answers"] = _dumps(values["answers"] or {})
+    return values
+
+
+def _insert(table, columns, record):
+    cols = [c for c in columns if c in record]
+    sql = f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+    _execute(sql, [record[c] for c in cols])
+
+
+# Tests
+
+# Tests are few, only ever inserted, and read on nearly every page, so they
+# are kept in memory. Local inserts reset the cache; tests uploaded in another
+# worker show up in list_tests within TESTS_CACHE_TTL seconds, and get_test
+# falls back to a primary-key lookup for ids it hasn't seen yet.
+TESTS_CACHE_TTL = 5.0
+_tests_cache = None
+_tests_loaded_at = 0.0
+
+
+def _tests_by_id():
+    global _tests_cache, _tests_loaded_at
+    cache = _tests_cache
+    if cache is not None and time.monotonic() - _tests_loaded_at < TESTS_CACHE_TTL:
+        return cache
+    with _lock:
+        rows = get_conn().execute("SELECT * FROM tests ORDER BY created_at").fetchall()
+        _tests_cache = {r["id"]: dict(r) for r in rows}
+        _tests_loaded_at = time.monotonic()
+        return _tests_cache
+
+
+def list_tests():
+    return [dict(t) for t in _tests_by_id().values()]
+
+
+def get_test(test_id):
+    test = _tests_by_id().get(test_id)
+    if test is None:
+        row = _fetchone("SELECT * FROM tests WHERE id = ?", (test_id,))
+        return dict(row) if row else None
+    return dict(test)
+
+
+def insert_test(test):
+    global _tests_cache
+    with _lock:
+        _insert("tests", TEST_COLUMNS, test)
+        _tests_cache = None
+
+
+# Submissions
+
+def list_submissions():
+    return [_submission_from_row(r) for r in _fetchall("SELECT * FROM submissions ORDER BY created_at")]
+
+
+def list_submissions_by_test(test_id):
+    rows = _fetchall("SELECT * FROM submissions WHERE test_id = ? ORDER BY created_at", (test_id,))
+    return [_submission_from_row(r) for r in rows]
+
+
+def iter_submission_rows(test_id, columns):
+    # Plain tuples in `columns` order, for bulk exports.
+    # Separate read connection so a long export doesn't hold the shared lock
+    unknown = set(columns) - set(SUBMISSION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown submission fields: {', '.join(sorted(unknown))}")
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(columns)} FROM submissions WHERE test_id = ? ORDER BY created_at",
+            (test_id,)
+        )
+        yield from rows
+    finally:
+        conn.close()
+
+
+def get_submission(submission_id):
+    return _submission_from_row(_fetchone("SELECT * FROM submissions WHERE id = ?", (submission_id,)))
+
+
+def insert_submission(sub):
+    _insert("submissions", SUBMISSION_COLUMNS, _submission_values(sub))
+
+
+def update_submission(submission_id, **fields):
+    unknown = set(fields) - set(SUBMISSION_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown submission fields: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    values = _submission_values(fields)
+    assignments = ", ".join(f"{c} = ?" for c in values)
+    _execute(f"UPDATE submissions SET {assignments} WHERE id = ?", [*values.values(), submission_id])
+
+
+def update_submissions(updates):
+    # Apply {submission_id: fields} in one transaction
+    for fields in updates.values():
+        unknown = set(fields) - set(SUBMISSION_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown submission fields: {', '.join(sorted(unknown))}")
+    with _lock:
+        conn = get_conn()
+        with conn:
+            for submission_id, fields in updates.items():
+                if not fields:
+                    continue
+                values = _submission_values(fields)
+                assignments = ", ".join(f"{c} = ?" for c in values)
+                conn.execute(f"UPDATE submissions SET {assignments} WHERE id = ?", [*values.values(), submission_id])
+
+
+# Coupons
+
+def list_coupons():
+    return [_coupon_from_row(r) for r in _fetchall("SELECT * FROM coupons ORDER BY created_at")]
+
+
+def get_coupon(code):
+    return _coupon_from_row(_fetchone("SELECT * FROM coupons WHERE code = ?", (code,)))
+
+
+def insert_coupon(coupon):
+    values = dict(coupon)
+    values["used"] = int(bool(values.get("used", False)))
+    _insert("coupons", COUPON_COLUMNS, values)
+
+
+def mark_coupon_used(code):
+    _execute("UPDATE coupons SET used = 1 WHERE code = ?", (code,))
+
+
+def coupon_exists(owner_submission_id, referred_submission_id):
+    row = _fetchone(
+        "SELECT 1 FROM coupons WHERE owner_submission_id = ? AND referred_submission_id = ?",
+        (owner_submission_id, referred_submission_id)
+    )
+    return row is not None
+
+
+# One-off import of the old JSON stores so existing deployments keep their data
+
+def import_json(tests_file, submissions_file, coupons_file):
+    def _read(path):
+        if not os.path.exists(path):
+            return []
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except Exception:
+            return []
+        return data if isinstance(data, list) else []
+
+    def _import(conn, table, columns, record):
+        cols = [c for c in columns if c in record]
+        sql = f"INSERT OR IGNORE INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        try:
+            conn.execute(sql, [record[c] for c in cols])
+        except (sqlite3.Error, TypeError, ValueError):
+            # Skip rows that can't be stored rather than failing startup
+            pass
+
+    global _tests_cache
+    with _lock:
+        conn = get_conn()
+        if conn.execute("SELECT EXISTS(SELECT 1 FROM tests) OR EXISTS(SELECT 1 FROM submissions)").fetchone()[0]:
+            return
+        # One transaction, so a partial import can never block a later retry.
+        # OR IGNORE drops duplicate keys and rows missing NOT NULL values.
+        with conn:
+            for t in _read(tests_file):
+                if isinstance(t, dict) and t.get("id") and t.get("title") and t.get("filename"):
+                    _import(conn, "tests", TEST_COLUMNS, {c: t[c] for c in TEST_COLUMNS if t.get(c) is not None})
+            for s in _read(submissions_file):
+                if isinstance(s, dict) and s.get("id") and s.get("test_id"):
+                    try:
+                        values = _submission_values({c: s[c] for c in SUBMISSION_COLUMNS if c in s})
+                    except (TypeError, ValueError):
+                        continue
+                    _import(conn, "submissions", SUBMISSION_COLUMNS, values)
+            for c in _read(coupons_file):
+                if isinstance(c, dict) and c.get("code"):
+                    values = {k: c[k] for k in COUPON_COLUMNS if k in c}
+                    values["used"] = int(bool(values.get("used", False)))
+                    _import(conn, "coupons", COUPON_COLUMNS, values)
+        _tests_cache = None
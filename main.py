@@ -1,17 +1,33 @@
 import os
+import atexit
 import csv
+import hashlib
+import hmac
 import json
+import mmap
+import secrets
+import tempfile
+import threading
+import unicodedata
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import wraps
+from functools import lru_cache, wraps
+from io import StringIO
+from types import MappingProxyType
+from urllib.parse import quote
 
 from flask import (
     Flask, render_template, request, redirect, url_for, flash, session,
-    send_file, jsonify
+    send_file, jsonify, g, Response, stream_with_context, stream_template,
+    get_flashed_messages
 )
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
+import db
+
 # Try import razorpay, but allow demo mode if not available
 try:
     import razorpay
@@ -20,18 +36,28 @@ except Exception:
     razorpay = None
     HAS_RAZORPAY = False
 
+# orjson is optional; fall back to the stdlib json module
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 # Load env
 load_dotenv()
 
 ADMIN_PASS = os.environ.get("ADMIN_PASS", "changeme")
+ADMIN_PASS_BYTES = ADMIN_PASS.encode("utf-8")
 RAZORPAY_KEY_ID = os.environ.get("RAZORPAY_KEY_ID", "").strip()
 RAZORPAY_KEY_SECRET = os.environ.get("RAZORPAY_KEY_SECRET", "").strip()
+RAZORPAY_KEY_SECRET_BYTES = RAZORPAY_KEY_SECRET.encode("utf-8")
 SECRET_KEY = os.environ.get("SECRET_KEY") or os.urandom(24).hex()
 
 DEMO_MODE = not (RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET and HAS_RAZORPAY)
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
+# Cache compiled templates on disk so new workers skip recompiling them
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -39,50 +65,259 @@ QUIZ_DIR = os.path.join(DATA_DIR, "quizzes")
 for d in (DATA_DIR, QUIZ_DIR):
     os.makedirs(d, exist_ok=True)
 
+# Legacy JSON stores, imported into SQLite on first start
 TESTS_FILE = os.path.join(DATA_DIR, "tests.json")
 SUBMISSIONS_FILE = os.path.join(DATA_DIR, "submissions.json")
 COUPONS_FILE = os.path.join(DATA_DIR, "coupons.json")
 
+db.init_db()
+db.import_json(TESTS_FILE, SUBMISSIONS_FILE, COUPONS_FILE)
+atexit.register(db.compact)
+
+# Single background writer for saves the response doesn't depend on.
+# One thread keeps the writes in submission order; registered after
+# db.compact so pending writes are flushed before the WAL is checkpointed.
+WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+atexit.register(WRITER.shutdown, wait=True)
+
+
+def _log_write_error(future):
+    exc = future.exception()
+    if exc:
+        app.logger.error("Background write failed", exc_info=exc)
+
+
+def write_in_background(fn, *args, **kwargs):
+    WRITER.submit(fn, *args, **kwargs).add_done_callback(_log_write_error)
+
+
+# Submission updates from a burst of submit_test calls are coalesced: they
+# collect in _pending (keyed by submission id) and a timer started by the
+# first one flushes them all in a single transaction FLUSH_DELAY later.
+# get_submission overlays _pending, but the admin listing and export
+# (db.list_submissions_by_test, db.iter_submission_rows) read SQLite only,
+# as do other workers, so they see an update once it has been flushed.
+FLUSH_DELAY = 0.1
+FLUSH_RETRY_MAX = 5.0
+_pending = {}
+_pending_lock = threading.Lock()
+_flush_timer = None
+_flush_retry_delay = FLUSH_DELAY
+
+
+def _start_flush_timer(delay):
+    # Caller holds _pending_lock
+    global _flush_timer
+    _flush_timer = threading.Timer(delay, write_in_background, (flush_pending_submissions,))
+    _flush_timer.daemon = True
+    _flush_timer.start()
+
+
+def queue_submission_update(submission_id, **fields):
+    with _pending_lock:
+        _pending.setdefault(submission_id, {}).update(fields)
+        if _flush_timer is None:
+            _start_flush_timer(FLUSH_DELAY)
+
+
+def flush_pending_submissions():
+    global _flush_timer, _flush_retry_delay
+    # The lock is held through the write so readers never see a submission
+    # that has left _pending but is not committed yet
+    with _pending_lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        if not _pending:
+            return
+        try:
+            db.update_submissions(_pending)
+        except Exception:
+            # Keep the updates and try again (e.g. "database is locked" while
+            # another worker writes), backing off up to FLUSH_RETRY_MAX
+            _flush_retry_delay = min(_flush_retry_delay * 2, FLUSH_RETRY_MAX)
+            _start_flush_timer(_flush_retry_delay)
+            raise
+        _pending.clear()
+        _flush_retry_delay = FLUSH_DELAY
+
+
+# Registered after WRITER.shutdown so it runs first at exit
+atexit.register(flush_pending_submissions)
+
 
 def _load_json(path, default):
     if not os.path.exists(path):
-        with open(path, "w") as f:
-            json.dump(default, f, indent=2)
         return default
-    with open(path, "r") as f:
+    with open(path, "rb") as f:
         try:
-            return json.load(f)
+            raw = f.read()
+            return orjson.loads(raw) if orjson else json.loads(raw)
         except Exception:
             return default
 
 
 def _save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=2, default=str)
+    if orjson:
+        raw = orjson.dumps(data, default=str)
+    else:
+        raw = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    # Write to a temp file and rename so readers never see a torn file.
+    # The temp name is unique so concurrent rebuilds of the same sidecar
+    # don't replace each other's files.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _load_json_mmap(path):
+    # Map the file rather than read() it so the bytes come straight from the page cache
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if orjson:
+                with memoryview(m) as view:
+                    return orjson.loads(view)
+            return json.loads(m[:])
+    except (OSError, ValueError):
+        return None
+
+
+QUIZ_COLUMNS = ("question", "option_a", "option_b", "option_c", "option_d", "answer")
+
+
+def _parse_quiz_csv(path):
+    # Positional reader: column indexes are resolved once from the header
+    # instead of building a dict for every row
+    questions = []
+    answer_key = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = {h.strip(): i for i, h in enumerate(next(reader, []))}
+        cols = [header.get(c) for c in QUIZ_COLUMNS]
+        qid = 0
+        for row in reader:
+            if not row:
+                continue
+            qid += 1
+            question, a, b, c, d, answer = (row[i] if i is not None and i < len(row) else "" for i in cols)
+            questions.append({
+                "qid": qid,
+                "question": question,
+                "options": {"A": a, "B": b, "C": c, "D": d}
+            })
+            answer_key.append(answer.strip().upper())
+    return questions, answer_key
+
+
+def write_quiz_sidecars(quiz_path):
+    questions, answer_key = _parse_quiz_csv(quiz_path)
+    _save_json(questions_path(quiz_path), questions)
+    _save_json(answers_path(quiz_path), answer_key)
+    return questions, answer_key
+
+
+def _sidecar_is_current(sidecar, quiz_path):
+    # A sidecar older than its CSV was built from a file that has since been replaced
+    try:
+        return os.path.getmtime(sidecar) >= os.path.getmtime(quiz_path)
+    except OSError:
+        return False
+
+
+# Quiz CSVs rarely change after upload, so load each one once per process.
+# The CSV's mtime is part of the key, and sidecars older than the CSV are
+# rebuilt, so a replaced file is picked up again.
+@lru_cache(maxsize=128)
+def _load_quiz_cached(path, mtime):
+    questions = None
+    if _sidecar_is_current(questions_path(path), path):
+        questions = _load_json_mmap(questions_path(path))
+    if questions is None:
+        # No sidecar yet (older upload) or the CSV was replaced
+        questions, _ = write_quiz_sidecars(path)
+    return tuple(
+        MappingProxyType({**q, "options": MappingProxyType(q["options"])})
+        for q in questions
+    )
 
 
-def load_tests():
-    return _load_json(TESTS_FILE, [])
+def load_answer_key(quiz_path):
+    # List of answer letters; question N is at index N-1
+    answer_key = None
+    if _sidecar_is_current(answers_path(quiz_path), quiz_path):
+        answer_key = _load_json(answers_path(quiz_path), None)
+    if not isinstance(answer_key, list):
+        # Missing (older upload), stale, or an older {qid: answer} key: rebuild
+        _, answer_key = write_quiz_sidecars(quiz_path)
+    return answer_key
 
 
-def save_tests(tests):
-    _save_json(TESTS_FILE, tests)
+def load_quiz(quiz_path):
+    return _load_quiz_cached(quiz_path, os.path.getmtime(quiz_path))
 
 
-def load_submissions():
-    return _load_json(SUBMISSIONS_FILE, [])
+def questions_path(quiz_path):
+    return quiz_path + ".questions.json"
 
 
-def save_submissions(subs):
-    _save_json(SUBMISSIONS_FILE, subs)
+def answers_path(quiz_path):
+    return quiz_path + ".answers.json"
 
 
-def load_coupons():
-    return _load_json(COUPONS_FILE, [])
+# Submissions are memoized on flask.g so a request that touches the same
+# record several times (payment -> referral award) only queries it once.
+def _submissions_by_id():
+    return g.setdefault("submissions_by_id", {})
 
 
-def save_coupons(coupons):
-    _save_json(COUPONS_FILE, coupons)
+def get_submission(submission_id):
+    subs = _submissions_by_id()
+    if submission_id not in subs:
+        with _pending_lock:
+            sub = db.get_submission(submission_id)
+            if sub and submission_id in _pending:
+                sub.update(_pending[submission_id])
+        subs[submission_id] = sub
+    return subs[submission_id]
+
+
+def insert_submission(sub):
+    db.insert_submission(sub)
+    _submissions_by_id()[sub["id"]] = sub
+
+
+def update_submission(submission_id, **fields):
+    db.update_submission(submission_id, **fields)
+    sub = _submissions_by_id().get(submission_id)
+    if sub:
+        sub.update(fields)
+
+
+# Coupons get the same per-request memo, keyed by code
+def _coupons_by_code():
+    return g.setdefault("coupons_by_code", {})
+
+
+def get_coupon(code):
+    coupons = _coupons_by_code()
+    if code not in coupons:
+        coupons[code] = db.get_coupon(code)
+    return coupons[code]
+
+
+def mark_coupon_used(code):
+    db.mark_coupon_used(code)
+    coupon = _coupons_by_code().get(code)
+    if coupon:
+        coupon["used"] = True
 
 
 def admin_required(f):
@@ -106,7 +341,7 @@ if not DEMO_MODE:
 
 @app.route("/")
 def index():
-    tests = load_tests()
+    tests = db.list_tests()
     return render_template("index.html", tests=tests, demo=DEMO_MODE)
 
 
@@ -114,7 +349,7 @@ def index():
 def admin_login():
     if request.method == "POST":
         pwd = request.form.get("password", "")
-        if pwd == ADMIN_PASS:
+        if hmac.compare_digest(pwd.encode("utf-8"), ADMIN_PASS_BYTES):
             session["admin"] = True
             flash("Logged in as admin", "success")
             return redirect(url_for("admin_dashboard"))
@@ -133,9 +368,9 @@ def admin_logout():
 @app.route("/admin")
 @admin_required
 def admin_dashboard():
-    tests = load_tests()
-    submissions = load_submissions()
-    coupons = load_coupons()
+    tests = db.list_tests()
+    submissions = db.list_submissions()
+    coupons = db.list_coupons()
     return render_template("admin_dashboard.html", tests=tests, submissions=submissions, coupons=coupons)
 
 
@@ -160,11 +395,10 @@ def admin_upload():
             flash("CSV file is required", "warning")
             return redirect(request.url)
         filename = secure_filename(file.filename)
-        # Validate CSV headers
-        stream = file.stream.read().decode("utf-8").splitlines()
-        reader = csv.DictReader(stream)
-        required = {"question", "option_a", "option_b", "option_c", "option_d", "answer"}
-        if not required.issubset(set([h.strip() for h in reader.fieldnames or []])):
+        # Validate CSV headers (only the first line is read here)
+        first_line = file.stream.readline().decode("utf-8")
+        fieldnames = next(csv.reader([first_line]), [])
+        if not set(QUIZ_COLUMNS).issubset(set([h.strip() for h in fieldnames])):
             flash("CSV must contain headers: question,option_a,option_b,option_c,option_d,answer", "danger")
             return redirect(request.url)
         # Save file
@@ -172,16 +406,17 @@ def admin_upload():
         test_filename = f"{test_id}.csv"
         file.stream.seek(0)
         save_path = os.path.join(QUIZ_DIR, test_filename)
-        file.save(save_path)
-        tests = load_tests()
-        tests.append({
+        file.save(save_path, buffer_size=64 * 1024)
+        # Parse once here and store questions/answer key next to the CSV,
+        # so the request path never has to parse it
+        write_quiz_sidecars(save_path)
+        db.insert_test({
             "id": test_id,
             "title": title,
             "price_inr": float(price),
             "filename": test_filename,
             "created_at": datetime.utcnow().isoformat()
         })
-        save_tests(tests)
         flash("Test uploaded", "success")
         return redirect(url_for("admin_dashboard"))
     return render_template("upload_test.html")
@@ -190,52 +425,52 @@ def admin_upload():
 @app.route("/admin/test/<test_id>/submissions")
 @admin_required
 def admin_view_submissions(test_id):
-    submissions = [s for s in load_submissions() if s.get("test_id") == test_id]
-    tests = load_tests()
-    test = next((t for t in tests if t["id"] == test_id), None)
+    submissions = db.list_submissions_by_test(test_id)
+    test = db.get_test(test_id)
     return render_template("admin_view_submissions.html", submissions=submissions, test=test)
 
 
+def _attachment_filename(filename):
+    # Same as send_file: ASCII fallback in filename, UTF-8 name in filename* (RFC 5987)
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+        quoted = quote(filename, safe="!#$&+^`|~")
+        return {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    return {"filename": filename}
+
+
 @app.route("/admin/test/<test_id>/download")
 @admin_required
 def admin_download_submissions(test_id):
-    subs = [s for s in load_submissions() if s.get("test_id") == test_id]
-    tests = load_tests()
-    test = next((t for t in tests if t["id"] == test_id), None)
-    csv_rows = []
+    test = db.get_test(test_id)
     headers = ["submission_id", "name", "mobile", "institute", "address", "paid", "payment_id", "score", "created_at", "ref_used", "coupon_used"]
-    for s in subs:
-        csv_rows.append({
-            "submission_id": s.get("id"),
-            "name": s.get("name"),
-            "mobile": s.get("mobile"),
-            "institute": s.get("institute", ""),
-            "address": s.get("address", ""),
-            "paid": s.get("paid", False),
-            "payment_id": s.get("payment_id", ""),
-            "score": s.get("score", ""),
-            "created_at": s.get("created_at", ""),
-            "ref_used": s.get("ref", ""),
-            "coupon_used": s.get("coupon_used", "")
-        })
-    # create CSV in-memory
-    from io import StringIO, BytesIO
-    si = StringIO()
-    writer = csv.DictWriter(si, fieldnames=headers)
-    writer.writeheader()
-    for r in csv_rows:
-        writer.writerow(r)
-    mem = BytesIO()
-    mem.write(si.getvalue().encode("utf-8"))
-    mem.seek(0)
+    # Submission columns in the same order as headers
+    columns = ("id", "name", "mobile", "institute", "address", "paid", "payment_id", "score", "created_at", "ref", "coupon_used")
+    paid_idx = columns.index("paid")
+
+    # Stream rows straight from the SQL cursor, reusing one small buffer
+    def generate():
+        si = StringIO()
+        writer = csv.writer(si)
+        writer.writerow(headers)
+        yield si.getvalue()
+        for row in db.iter_submission_rows(test_id, columns):
+            si.seek(0)
+            si.truncate(0)
+            writer.writerow(row[:paid_idx] + (bool(row[paid_idx]),) + row[paid_idx + 1:])
+            yield si.getvalue()
+
     filename = f"submissions_{test['title'] if test else test_id}.csv"
-    return send_file(mem, as_attachment=True, download_name=filename, mimetype="text/csv")
+    response = Response(stream_with_context(generate()), mimetype="text/csv")
+    response.headers.set("Content-Disposition", "attachment", **_attachment_filename(filename))
+    return response
 
 
 @app.route("/student_form/<test_id>", methods=["GET", "POST"])
 def student_form(test_id):
-    tests = load_tests()
-    test = next((t for t in tests if t["id"] == test_id), None)
+    test = db.get_test(test_id)
     if not test:
         flash("Test not found", "danger")
         return redirect(url_for("index"))
@@ -250,7 +485,6 @@ def student_form(test_id):
             flash("Full name and mobile are required", "warning")
             return redirect(request.url)
         submission_id = str(uuid.uuid4())
-        submissions = load_submissions()
         new_sub = {
             "id": submission_id,
             "test_id": test_id,
@@ -266,32 +500,22 @@ def student_form(test_id):
             "ref": ref,
             "coupon_used": coupon_code or ""
         }
-        submissions.append(new_sub)
-        save_submissions(submissions)
+        insert_submission(new_sub)
         # Process payment or demo
         apply_discount = 0.0
-        coupons = load_coupons()
         if coupon_code:
-            c = next((c for c in coupons if c["code"] == coupon_code and not c.get("used", False)), None)
-            if c:
+            c = get_coupon(coupon_code)
+            if c and not c.get("used", False):
                 apply_discount = float(c.get("discount_percent", 0.0))
         price = float(test.get("price_inr", 0.0))
         payable = max(0.0, price * (1 - apply_discount / 100.0))
         # If demo mode or payable == 0 => skip payment
         if DEMO_MODE or payable <= 0:
             # Mark paid, possibly mark coupon used (if any)
-            for s in submissions:
-                if s["id"] == submission_id:
-                    s["paid"] = True
-                    s["payment_id"] = "DEMO" if DEMO_MODE else ""
-                    break
+            update_submission(submission_id, paid=True, payment_id="DEMO" if DEMO_MODE else "")
             # If coupon used, mark as used
             if coupon_code:
-                for c in coupons:
-                    if c["code"] == coupon_code:
-                        c["used"] = True
-                save_coupons(coupons)
-            save_submissions(submissions)
+                mark_coupon_used(coupon_code)
             # Award referral coupon to referrer if applicable
             maybe_award_referrer_coupon(submission_id)
             session["submission_id"] = submission_id
@@ -308,13 +532,7 @@ def student_form(test_id):
                         "payment_capture": 1
                     })
                     # Save order id in submission for later verification
-                    for s in submissions:
-                        if s["id"] == submission_id:
-                            s["order_id"] = order.get("id")
-                            s["payable"] = payable
-                            s["price"] = price
-                            save_submissions(submissions)
-                            break
+                    update_submission(submission_id, order_id=order.get("id"), payable=payable, price=price)
                     # Render payment page with details
                     return render_template("payment.html",
                                            razor_key=RAZORPAY_KEY_ID,
@@ -345,71 +563,54 @@ def payment_success():
     submission_id = payload.get("submission_id")
     if not (payment_id and order_id and signature and submission_id):
         return jsonify({"status": "error", "message": "Missing payment data"}), 400
-    # Verify signature using razorpay util if available
+    # Verify signature: HMAC-SHA256 of "<order_id>|<payment_id>" keyed with the secret,
+    # same formula as razorpay's utility.verify_payment_signature
     verified = False
     if not DEMO_MODE and razor_client:
-        try:
-            params_dict = {
-                "razorpay_order_id": order_id,
-                "razorpay_payment_id": payment_id,
-                "razorpay_signature": signature
-            }
-            razor_client.utility.verify_payment_signature(params_dict)
-            verified = True
-        except Exception:
-            verified = False
+        expected = hmac.new(RAZORPAY_KEY_SECRET_BYTES, f"{order_id}|{payment_id}".encode("utf-8"), hashlib.sha256).hexdigest()
+        verified = hmac.compare_digest(expected.encode("ascii"), signature.encode("utf-8"))
     else:
         # Demo: accept
         verified = True
     if not verified:
         return jsonify({"status": "error", "message": "Signature verification failed"}), 400
     # Mark submission paid
-    submissions = load_submissions()
-    for s in submissions:
-        if s["id"] == submission_id:
-            s["paid"] = True
-            s["payment_id"] = payment_id
-            s["order_id"] = order_id
-            s.setdefault("payable", None)
-            break
-    save_submissions(submissions)
+    submission = get_submission(submission_id)
+    if not submission:
+        return jsonify({"status": "error", "message": "Submission not found"}), 404
+    update_submission(submission_id, paid=True, payment_id=payment_id, order_id=order_id)
     # Mark coupon used if any
-    coupon_code = next((s.get("coupon_used", "") for s in submissions if s["id"] == submission_id), "")
+    coupon_code = submission.get("coupon_used") or ""
     if coupon_code:
-        coupons = load_coupons()
-        for c in coupons:
-            if c["code"] == coupon_code:
-                c["used"] = True
-        save_coupons(coupons)
+        mark_coupon_used(coupon_code)
     # Award referral coupon to referrer if applicable
     maybe_award_referrer_coupon(submission_id)
+    # Make sure queued submission updates are on disk before confirming payment
+    flush_pending_submissions()
     # Return success (frontend will redirect to take_test)
-    return jsonify({"status": "ok", "redirect": url_for("take_test", test_id=s["test_id"], sid=submission_id)})
+    return jsonify({"status": "ok", "redirect": url_for("take_test", test_id=submission["test_id"], sid=submission_id)})
 
 
 def maybe_award_referrer_coupon(new_submission_id):
     # If the new paid submission used ref and ref maps to an existing submission id,
-    # award a 50% coupon to the referrer (stored in coupons.json)
-    subs = load_submissions()
-    new_sub = next((s for s in subs if s["id"] == new_submission_id), None)
+    # award a 50% coupon to the referrer (stored in the coupons table)
+    new_sub = get_submission(new_submission_id)
     if not new_sub or not new_sub.get("paid"):
         return
     ref = new_sub.get("ref")
     if not ref:
         return
     # Ensure ref exists
-    ref_sub = next((s for s in subs if s["id"] == ref), None)
+    ref_sub = get_submission(ref)
     if not ref_sub:
         return
     # Do not award if referrer is the same person
     if ref_sub.get("mobile") == new_sub.get("mobile"):
         return
-    coupons = load_coupons()
     # Award one coupon per successful referral (no duplicate coupon per (referrer, referred) pair)
-    exists = any(c for c in coupons if c.get("owner_submission_id") == ref and c.get("referred_submission_id") == new_submission_id)
-    if exists:
+    if db.coupon_exists(ref, new_submission_id):
         return
-    coupon_code = f"CPN-{uuid.uuid4().hex[:8].upper()}"
+    coupon_code = f"CPN-{secrets.token_hex(4).upper()}"
     coupon = {
         "code": coupon_code,
         "owner_submission_id": ref,
@@ -418,23 +619,22 @@ def maybe_award_referrer_coupon(new_submission_id):
         "used": False,
         "created_at": datetime.utcnow().isoformat()
     }
-    coupons.append(coupon)
-    save_coupons(coupons)
+    db.insert_coupon(coupon)
 
 
 @app.route("/take_test/<test_id>")
 def take_test(test_id):
     sid = request.args.get("sid") or request.args.get("submission_id") or session.get("submission_id")
-    tests = load_tests()
-    test = next((t for t in tests if t["id"] == test_id), None)
+    test = db.get_test(test_id)
     if not test:
         flash("Test not found", "danger")
         return redirect(url_for("index"))
     if not sid:
         flash("Submission/session missing. Start test flow from homepage.", "warning")
         return redirect(url_for("student_form", test_id=test_id))
-    subs = load_submissions()
-    submission = next((s for s in subs if s["id"] == sid and s["test_id"] == test_id), None)
+    submission = get_submission(sid)
+    if submission and submission["test_id"] != test_id:
+        submission = None
     if not submission:
         flash("Submission record not found", "danger")
         return redirect(url_for("student_form", test_id=test_id))
@@ -442,23 +642,20 @@ def take_test(test_id):
     if not DEMO_MODE and not submission.get("paid"):
         flash("Payment required before starting the test", "warning")
         return redirect(url_for("student_form", test_id=test_id))
-    # Load quiz CSV
+    # Questions come from the cached JSON sidecar, not the CSV
     quiz_path = os.path.join(QUIZ_DIR, test["filename"])
-    questions = []
-    with open(quiz_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for idx, row in enumerate(reader, start=1):
-            questions.append({
-                "qid": idx,
-                "question": row.get("question", ""),
-                "options": {
-                    "A": row.get("option_a", ""),
-                    "B": row.get("option_b", ""),
-                    "C": row.get("option_c", ""),
-                    "D": row.get("option_d", "")
-                }
-            })
-    return render_template("take_test.html", test=test, questions=questions, submission=submission)
+    questions = load_quiz(quiz_path)
+    # Pop flashed messages before streaming starts, while the session cookie
+    # can still be updated; the template reads them back from the request.
+    get_flashed_messages(with_categories=True)
+    return stream_template("take_test.html", test=test, questions=questions, submission=submission)
+
+
+def score_answers(answer_key, answers):
+    # +4 per correct answer, -1 per wrong one, blanks don't count
+    attempted = [ans == answer_key[int(qid) - 1] for qid, ans in answers.items() if ans]
+    right = sum(attempted)
+    return 4 * right - (len(attempted) - right)
 
 
 @app.route("/submit_test/<test_id>", methods=["POST"])
@@ -467,40 +664,22 @@ def submit_test(test_id):
     if not sid:
         flash("Submission id missing", "danger")
         return redirect(url_for("index"))
-    subs = load_submissions()
-    submission = next((s for s in subs if s["id"] == sid and s["test_id"] == test_id), None)
+    submission = get_submission(sid)
+    if submission and submission["test_id"] != test_id:
+        submission = None
     if not submission:
         flash("Submission not found", "danger")
         return redirect(url_for("index"))
     # Load correct answers
-    tests = load_tests()
-    test = next((t for t in tests if t["id"] == test_id), None)
+    test = db.get_test(test_id)
     quiz_path = os.path.join(QUIZ_DIR, test["filename"])
-    correct = {}
-    with open(quiz_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for idx, row in enumerate(reader, start=1):
-            correct[str(idx)] = row.get("answer", "").strip().upper()
+    answer_key = load_answer_key(quiz_path)
     # Collect answers
-    answers = {}
-    score = 0
-    for qid in correct.keys():
-        ans = (request.form.get(f"q_{qid}") or "").strip().upper()
-        answers[qid] = ans
-        if not ans:
-            continue
-        if ans == correct[qid]:
-            score += 4
-        else:
-            score -= 1
-    # Save submission
-    for s in subs:
-        if s["id"] == sid:
-            s["answers"] = answers
-            s["score"] = score
-            s["completed_at"] = datetime.utcnow().isoformat()
-            break
-    save_submissions(subs)
+    form = request.form
+    answers = {str(qid): (form.get(f"q_{qid}") or "").strip().upper() for qid in range(1, len(answer_key) + 1)}
+    score = score_answers(answer_key, answers)
+    # Save submission; the result page only needs the score computed above
+    queue_submission_update(sid, answers=answers, score=score, completed_at=datetime.utcnow().isoformat())
     # Provide shareable referral link (ref code = submission id)
     refcode = sid
     return render_template("result.html", score=score, submission=submission, test=test, refcode=refcode)
@@ -509,7 +688,7 @@ def submit_test(test_id):
 @app.route("/coupons")
 def coupons_view():
     # Public endpoint to view coupons for demonstration (not required)
-    coupons = load_coupons()
+    coupons = db.list_coupons()
     return jsonify(coupons)
 
 
@@ -530,6 +709,15 @@ def health():
     return "ok"
 
 
+def warm_caches():
+    # Under `gunicorn --preload` this runs once in the master process and the
+    # parsed quizzes are shared copy-on-write by the forked workers
+    for test in db.list_tests():
+        quiz_path = os.path.join(QUIZ_DIR, test["filename"])
+        if os.path.exists(quiz_path):
+            load_quiz(quiz_path)
+
+
 if __name__ == "__main__":
     import os
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,12 @@
+import gc
+
+import db
+from main import app, warm_caches
+
+warm_caches()
+# Don't let forked workers inherit an open SQLite handle; each one opens
+# its own on first use
+db.close()
+# Keep objects loaded before the fork out of later GC passes, so workers
+# don't write to (and un-share) those pages
+gc.freeze()